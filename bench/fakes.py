@@ -0,0 +1,276 @@
+"""Local stand-ins for the remote services the worker talks to.
+
+Every fake is an aiohttp application served on the benchmark's own event
+loop, with an injectable per-request latency.
+"""
+import json
+import asyncio
+import hashlib
+import itertools
+
+from aiohttp import web
+from aioreactive.operators import from_iterable
+
+
+async def serve(loop, app, host='127.0.0.1'):
+    handler = app.make_handler()
+    srv = await loop.create_server(handler, host, 0)
+    port = srv.sockets[0].getsockname()[1]
+    return srv, handler, port
+
+
+class FakeDockerEngine:
+    """Just enough of the Docker Engine API for pulls and service updates."""
+    def __init__(self, latency=0.0, pull_latency=0.0):
+        self.latency = latency
+        self.pull_latency = pull_latency
+        self.services = {}
+        self.images = {}
+        self.pulls = 0
+        self.updates = 0
+
+        self.app = web.Application()
+        self.app.router.add_get('/_ping', self.ping)
+        self.app.router.add_get('/{version}/_ping', self.ping)
+        self.app.router.add_get('/{version}/version', self.version)
+        self.app.router.add_post('/{version}/auth', self.auth)
+        self.app.router.add_post('/{version}/images/create', self.create_image)
+        self.app.router.add_get('/{version}/images/{name:.+}/json', self.inspect_image)
+        self.app.router.add_get('/{version}/services', self.list_services)
+        self.app.router.add_get('/{version}/services/{id}', self.inspect_service)
+        self.app.router.add_post('/{version}/services/{id}/update', self.update_service)
+
+    def add_service(self, name, image):
+        self.services[name] = {
+            "ID": name,
+            "Version": {"Index": 1},
+            "Spec": {"Name": name, "TaskTemplate": {"ContainerSpec": {"Image": image}}},
+        }
+
+    def image(self, ref):
+        if ref not in self.images:
+            digest = hashlib.sha256(ref.encode()).hexdigest()
+            repo = ref.rsplit(':', 1)[0]
+            self.images[ref] = {"Id": f"sha256:{digest}", "RepoDigests": [f"{repo}@sha256:{digest}"], "RepoTags": [ref]}
+
+        return self.images[ref]
+
+    async def ping(self, request):
+        await asyncio.sleep(self.latency)
+        return web.Response(text='OK')
+
+    async def version(self, request):
+        await asyncio.sleep(self.latency)
+        return web.json_response({"ApiVersion": "1.30", "Version": "17.06.0-ce"})
+
+    async def auth(self, request):
+        await asyncio.sleep(self.latency)
+        return web.json_response({"Status": "Login Succeeded"})
+
+    async def create_image(self, request):
+        self.pulls += 1
+        ref = f"{request.query['fromImage']}:{request.query.get('tag', 'latest')}"
+        image = self.image(ref)
+
+        await asyncio.sleep(self.pull_latency)
+
+        events = [{"status": f"Pulling from {ref}"},
+                  {"status": "Downloading", "id": "layer", "progressDetail": {"current": 1, "total": 1}},
+                  {"status": f"Digest: {image['RepoDigests'][0].split('@')[1]}"},
+                  {"status": f"Status: Downloaded newer image for {ref}"}]
+
+        body = b''.join(json.dumps(event).encode() + b'\r\n' for event in events)
+        return web.Response(body=body, headers={"Content-Type": "application/json"})
+
+    async def inspect_image(self, request):
+        await asyncio.sleep(self.latency)
+        return web.json_response(self.image(request.match_info['name']))
+
+    async def list_services(self, request):
+        await asyncio.sleep(self.latency)
+        return web.json_response(list(self.services.values()))
+
+    async def inspect_service(self, request):
+        await asyncio.sleep(self.latency)
+        service = self.services.get(request.match_info['id'])
+        if service is None:
+            return web.json_response({"message": "service not found"}, status=404)
+
+        return web.json_response(service)
+
+    async def update_service(self, request):
+        await asyncio.sleep(self.latency)
+        service = self.services[request.match_info['id']]
+        spec = await request.json()
+
+        self.updates += 1
+        service["Spec"] = spec
+        service["Version"]["Index"] += 1
+        return web.json_response({"Warnings": None})
+
+
+class FakeKubernetes:
+    """Deployment discovery, list, watch, get and patch of a single API server.
+
+    Patched deployments report their new generation as observed after
+    `rollout` seconds.
+    """
+    def __init__(self, latency=0.0, rollout=0.0):
+        self.latency = latency
+        self.rollout = rollout
+        self.deployments = {}
+        self.patches = 0
+        self.revisions = itertools.count(2)
+        self.watchers = []
+
+        self.app = web.Application()
+        self.app.router.add_get('/version', self.version)
+        self.app.router.add_get('/apis/apps/v1', self.discovery)
+        self.app.router.add_get('/apis/apps/v1/namespaces/{namespace}/deployments', self.list_deployments)
+        self.app.router.add_get('/apis/apps/v1/namespaces/{namespace}/deployments/{name}', self.get_deployment)
+        self.app.router.add_patch('/apis/apps/v1/namespaces/{namespace}/deployments/{name}', self.patch_deployment)
+
+    def add_deployment(self, name, image, namespace='default'):
+        self.deployments[namespace, name] = {
+            "metadata": {"name": name, "namespace": namespace, "generation": 1, "resourceVersion": "1"},
+            "spec": {"replicas": 1, "template": {"spec": {"containers": [{"name": name, "image": image}]}}},
+            "status": {"observedGeneration": 1, "replicas": 1, "updatedReplicas": 1, "availableReplicas": 1},
+        }
+
+    async def version(self, request):
+        await asyncio.sleep(self.latency)
+        return web.json_response({"major": "1", "minor": "9"})
+
+    async def discovery(self, request):
+        await asyncio.sleep(self.latency)
+        return web.json_response({"resources": [{"name": "deployments", "namespaced": True}]})
+
+    async def list_deployments(self, request):
+        await asyncio.sleep(self.latency)
+        namespace = request.match_info['namespace']
+
+        if request.query.get('watch') == 'true':
+            return await self.watch_deployments(request, namespace)
+
+        return web.json_response({
+            "metadata": {"resourceVersion": str(max(
+                [int(d['metadata']['resourceVersion']) for d in self.deployments.values()] or [1]))},
+            "items": [d for (ns, _), d in self.deployments.items() if ns == namespace]
+        })
+
+    async def watch_deployments(self, request, namespace):
+        response = web.StreamResponse()
+        response.content_type = 'application/json'
+        await response.prepare(request)
+
+        queue = asyncio.Queue()
+        self.watchers.append((namespace, queue))
+        deadline = asyncio.get_event_loop().time() + float(request.query.get('timeoutSeconds', 300))
+
+        try:
+            while True:
+                remaining = deadline - asyncio.get_event_loop().time()
+                if remaining <= 0:
+                    break
+
+                try:
+                    event = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+                response.write(json.dumps(event).encode() + b'\n')
+                await response.drain()
+        finally:
+            self.watchers.remove((namespace, queue))
+
+        return response
+
+    def modified(self, deployment):
+        deployment['metadata']['resourceVersion'] = str(next(self.revisions))
+
+        for namespace, queue in self.watchers:
+            if namespace == deployment['metadata']['namespace']:
+                queue.put_nowait({"type": "MODIFIED", "object": deployment})
+
+    async def get_deployment(self, request):
+        await asyncio.sleep(self.latency)
+        deployment = self.deployments.get((request.match_info['namespace'], request.match_info['name']))
+        if deployment is None:
+            return web.json_response({"reason": "NotFound"}, status=404)
+
+        return web.json_response(deployment)
+
+    async def patch_deployment(self, request):
+        await asyncio.sleep(self.latency)
+        deployment = self.deployments[request.match_info['namespace'], request.match_info['name']]
+        patch = await request.json()
+
+        self.patches += 1
+        containers = {c['name']: c for c in deployment['spec']['template']['spec']['containers']}
+        changed = False
+        for container in patch['spec']['template']['spec']['containers']:
+            if containers[container['name']]['image'] != container['image']:
+                containers[container['name']]['image'] = container['image']
+                changed = True
+
+        if changed:
+            deployment['metadata']['generation'] += 1
+            asyncio.get_event_loop().call_later(self.rollout, self.converge, deployment)
+            self.modified(deployment)
+
+        return web.json_response(deployment)
+
+    def converge(self, deployment):
+        deployment['status']['observedGeneration'] = deployment['metadata']['generation']
+        self.modified(deployment)
+
+
+class WebhookSink:
+    """Accepts every POST, optionally failing a share of them with a 503."""
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.received = 0
+        self.counter = itertools.count()
+
+        self.app = web.Application()
+        self.app.router.add_post('/{hook}', self.receive)
+
+    async def receive(self, request):
+        await asyncio.sleep(self.latency)
+        await request.read()
+        self.received += 1
+
+        if self.failure_rate and next(self.counter) % int(1 / self.failure_rate) == 0:
+            return web.Response(status=503)
+
+        return web.Response(status=200)
+
+
+class FakeConnection:
+    """In-memory replacement for async_rethink.Connection that replays fixed tables."""
+    def __init__(self, tables):
+        self.tables = tables
+
+    async def connect(self):
+        pass
+
+    def db(self):
+        return self
+
+    def table(self, name):
+        return FakeTable(name)
+
+    async def run(self, query):
+        return len(self.tables.get(query.name, []))
+
+    def start_with_and_changes(self, table):
+        return from_iterable([{"old_val": None, "new_val": doc} for doc in self.tables.get(table.name, [])])
+
+
+class FakeTable:
+    def __init__(self, name):
+        self.name = name
+
+    def count(self):
+        return self
@@ -0,0 +1,177 @@
+"""Offline benchmark of the worker's routing, update and webhook paths.
+
+Runs the worker code against the local fakes in bench/fakes.py, for example:
+
+    python bench/run.py --environments 4 --services 500 --images 50 --latency 0.005
+
+and reports throughput, p50/p99 latency and peak memory for every phase.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+os.environ.setdefault('CONFIG_BATCH_WINDOW', '0.01')
+os.environ.setdefault('LOGLEVEL', '30')
+
+from fakes import serve, FakeDockerEngine, FakeKubernetes, WebhookSink, FakeConnection
+
+import configuration
+import worker
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def report(phase, samples, elapsed):
+    result = {
+        "phase": phase,
+        "count": len(samples),
+        "seconds": round(elapsed, 4),
+        "per_second": round(len(samples) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(samples, .50) * 1000, 3) if samples else None,
+        "p99_ms": round(percentile(samples, .99) * 1000, 3) if samples else None,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    print(json.dumps(result))
+    return result
+
+
+async def timed_call(samples, fn, *args):
+    start = time.perf_counter()
+    try:
+        return await fn(*args)
+    finally:
+        samples.append(time.perf_counter() - start)
+
+
+async def setup_environments(loop, args):
+    token = tempfile.NamedTemporaryFile('w', suffix='.token', delete=False)
+    token.write(base64.b64encode(b'bench-token').decode())
+    token.close()
+
+    fakes, servers, environments = {}, [], []
+    for i in range(args.environments):
+        swarm = args.mode == 'swarm' or (args.mode == 'mixed' and i % 2 == 0)
+
+        if swarm:
+            fake = FakeDockerEngine(latency=args.latency, pull_latency=args.pull_latency)
+            srv, handler, port = await serve(loop, fake.app)
+            environment = {
+                "name": f"swarm-{i}", "mode": "from_env", "tag-match": ".*",
+                "parameters": {"environment": {"DOCKER_HOST": f"tcp://127.0.0.1:{port}"}}
+            }
+        else:
+            fake = FakeKubernetes(latency=args.latency, rollout=args.rollout)
+            srv, handler, port = await serve(loop, fake.app)
+            environment = {
+                "name": f"k8s-{i}", "mode": "k8s_serviceaccount", "tag-match": ".*",
+                "tls": {"url": f"http://127.0.0.1:{port}", "ca": None, "token": token.name}
+            }
+
+        fakes[environment['name']] = fake
+        servers.append((srv, handler))
+        environments.append(environment)
+
+    return fakes, servers, environments
+
+
+async def bench(loop, args):
+    fakes, servers, environments = await setup_environments(loop, args)
+
+    sink = WebhookSink(latency=args.latency, failure_rate=args.webhook_failure_rate)
+    srv, handler, sink_port = await serve(loop, sink.app)
+    servers.append((srv, handler))
+
+    services = []
+    for j in range(args.services):
+        image = f"bench/app-{j % args.images}"
+        services.append({"name": f"svc-{j}", "image-name": image, "environments": [e['name'] for e in environments]})
+
+        for fake in fakes.values():
+            if isinstance(fake, FakeDockerEngine):
+                fake.add_service(f"svc-{j}", f"{image}:v0")
+            else:
+                fake.add_deployment(f"svc-{j}", f"{image}:v0")
+
+    cfg = configuration.Config()
+    cfg.connection = FakeConnection({"environments": environments, "services": services, "repos": []})
+
+    start = time.perf_counter()
+    await cfg.init()
+    await cfg.synced.wait()
+    report("config_sync", [time.perf_counter() - start], time.perf_counter() - start)
+
+    worker.cfg = cfg
+
+    samples, targets = [], []
+    start = time.perf_counter()
+    for push in range(1, args.pushes + 1):
+        for i in range(args.images):
+            begin = time.perf_counter()
+            targets.extend(worker.route(f"bench/app-{i}:v{push}"))
+            samples.append(time.perf_counter() - begin)
+    report("distribute_to", samples, time.perf_counter() - start)
+
+    samples = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        timed_call(samples, worker.updates.submit, (env, svc), worker.deploy, env, svc, image)
+        for env, svc, image in targets), return_exceptions=True)
+    report("update", samples, time.perf_counter() - start)
+
+    hooks = [{"url": f"http://127.0.0.1:{sink_port}/hook-{h}", "on": {"status": "updated", "image": "bench/.*"},
+              "body": "{service} {image}", "headers": {}} for h in range(args.hooks)]
+
+    samples = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        timed_call(samples, worker.webhooks.dispatch, hooks, {"status": "updated", "service": svc, "image": image})
+        for _, svc, image in targets[:args.webhook_events]))
+    report("webhook", samples, time.perf_counter() - start)
+
+    print(json.dumps({
+        "pulls": sum(f.pulls for f in fakes.values() if isinstance(f, FakeDockerEngine)),
+        "service_updates": sum(f.updates for f in fakes.values() if isinstance(f, FakeDockerEngine)),
+        "deployment_patches": sum(f.patches for f in fakes.values() if isinstance(f, FakeKubernetes)),
+        "webhooks_received": sink.received,
+    }))
+
+    await worker.webhooks.close()
+    await cfg.teardown()
+    for srv, handler in servers:
+        srv.close()
+        await handler.shutdown(1.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--environments', type=int, default=2)
+    parser.add_argument('--mode', choices=['swarm', 'k8s', 'mixed'], default='mixed')
+    parser.add_argument('--services', type=int, default=100)
+    parser.add_argument('--images', type=int, default=10)
+    parser.add_argument('--pushes', type=int, default=3, help='tags pushed per image')
+    parser.add_argument('--hooks', type=int, default=10)
+    parser.add_argument('--webhook-events', type=int, default=100)
+    parser.add_argument('--webhook-failure-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake API call')
+    parser.add_argument('--pull-latency', type=float, default=0.0, help='seconds added to every image pull')
+    parser.add_argument('--rollout', type=float, default=0.0, help='seconds until a patched deployment converges')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(bench(loop, args))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Startup benchmark of the worker: import time and time to its first task.
+
+Every sample runs in a fresh interpreter against the local fakes in
+bench/fakes.py, for example:
+
+    python bench/startup.py --mode k8s --environments 4 --repeat 5
+
+and reports the median import time, time to the first completed update,
+peak memory and which client stacks were loaded.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def child(args):
+    sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+    os.environ.setdefault('CONFIG_BATCH_WINDOW', '0.01')
+    os.environ.setdefault('LOGLEVEL', '30')
+
+    start = time.perf_counter()
+    import worker
+    imported = time.perf_counter() - start
+    stacks = {name: name in sys.modules for name in ('docker', 'kubernetes')}
+
+    import asyncio
+    import resource
+    import configuration
+    from fakes import FakeDockerEngine, FakeConnection
+    from run import setup_environments
+
+    async def first_task(loop):
+        fakes, servers, environments = await setup_environments(loop, args)
+        for fake in fakes.values():
+            if isinstance(fake, FakeDockerEngine):
+                fake.add_service("svc", "bench/app:v0")
+            else:
+                fake.add_deployment("svc", "bench/app:v0")
+
+        services = [{"name": "svc", "image-name": "bench/app", "environments": [e['name'] for e in environments]}]
+
+        start = time.perf_counter()
+        cfg = configuration.Config()
+        cfg.connection = FakeConnection({"environments": environments, "services": services, "repos": []})
+        await cfg.init()
+        await cfg.synced.wait()
+        worker.cfg = cfg
+
+        env, svc, image = worker.route("bench/app:v1")[0]
+        await worker.deploy(env, svc, image)
+        elapsed = time.perf_counter() - start
+
+        await cfg.teardown()
+        for srv, handler in servers:
+            srv.close()
+            await handler.shutdown(1.0)
+
+        return elapsed
+
+    loop = asyncio.get_event_loop()
+    ready = loop.run_until_complete(first_task(loop))
+    loop.close()
+
+    print(json.dumps({
+        "import_s": imported,
+        "first_task_s": ready,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "loaded": stacks,
+        "loaded_after_first_task": {name: name in sys.modules for name in ('docker', 'kubernetes')},
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--environments', type=int, default=1)
+    parser.add_argument('--mode', choices=['swarm', 'k8s', 'mixed'], default='swarm')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake API call')
+    parser.add_argument('--pull-latency', type=float, default=0.0, help='seconds added to every image pull')
+    parser.add_argument('--rollout', type=float, default=0.0, help='seconds until a patched deployment converges')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        output = subprocess.check_output([sys.executable, __file__, '--child'] + sys.argv[1:], cwd=here)
+        sample = json.loads(output.decode().splitlines()[-1])
+        sample["process_s"] = time.perf_counter() - start
+        samples.append(sample)
+
+    print(json.dumps({
+        "mode": args.mode,
+        "environments": args.environments,
+        "samples": len(samples),
+        **{key: round(statistics.median(s[key] for s in samples), 4)
+           for key in ("import_s", "first_task_s", "process_s")},
+        "peak_rss_kb": max(s["peak_rss_kb"] for s in samples),
+        "loaded": samples[-1]["loaded"],
+        "loaded_after_first_task": samples[-1]["loaded_after_first_task"],
+    }))
+
+
+if __name__ == '__main__':
+    main()
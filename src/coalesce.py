@@ -0,0 +1,54 @@
+import asyncio
+
+
+class Superseded(Exception):
+    pass
+
+
+class CoalescingQueue:
+    """Serializes work per key, keeping only the newest pending item.
+
+    At most one item per key runs at a time. While it runs, only the most
+    recently submitted item waits behind it; older waiting items are dropped
+    and their callers get Superseded.
+    """
+    def __init__(self):
+        self.running = {}
+        self.pending = {}
+
+    async def submit(self, key, fn, *args, **kwargs):
+        if key in self.running:
+            await self.wait_turn(key)
+
+        task = self.running[key] = asyncio.ensure_future(fn(*args, **kwargs))
+        try:
+            return await task
+        finally:
+            self.hand_over(key)
+
+    async def wait_turn(self, key):
+        previous = self.pending.pop(key, None)
+        if previous is not None and not previous.done():
+            previous.set_exception(Superseded())
+
+        waiter = self.pending[key] = asyncio.get_event_loop().create_future()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if self.pending.get(key) is waiter:
+                del self.pending[key]
+            elif self.running.get(key) is waiter:
+                self.hand_over(key)
+            raise
+
+    def hand_over(self, key):
+        waiter = self.pending.pop(key, None)
+        if waiter is None or waiter.done():
+            self.running.pop(key, None)
+        else:
+            # Keep the key reserved until the woken caller starts its item.
+            self.running[key] = waiter
+            waiter.set_result(None)
+
+    def __len__(self):
+        return len(self.pending)
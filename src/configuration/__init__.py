@@ -1,4 +1,5 @@
 import os
+import asyncio
 from collections import defaultdict
 from operator import itemgetter
 
@@ -9,6 +10,8 @@ from aioreactive.core import AsyncAnonymousObserver, subscribe, Operators
 import configuration.environment as environment
 import configuration.service as service
 import configuration.repo as repo
+import configuration.routing as routing
+import configuration.snapshot as snapshot
 
 from logzero import logger
 
@@ -24,8 +27,14 @@ class Config:
         self.addr = os.environ.get('DATABASE_HOST')
         self.port = os.environ.get('DATABASE_PORT')
 
+        self.snapshot_path = os.environ.get('CONFIG_SNAPSHOT')
+        self.snapshot_interval = float(os.environ.get('CONFIG_SNAPSHOT_INTERVAL', 5))
+        self.sync_timeout = float(os.environ.get('CONFIG_SYNC_TIMEOUT', 30))
+        self.batch_window = float(os.environ.get('CONFIG_BATCH_WINDOW', 0.05))
+
         self.connection = Connection(self.addr, self.port)
-        self.latest_config = keydefaultdict(lambda name: self.configs[name].init())
+        self.routing = routing.RoutingTable()
+        self.latest_config = keydefaultdict(lambda name: self.configs[name].init(self.routing))
         
         self.configs = {cfg.name: cfg for cfg in [
             environment,
@@ -33,32 +42,185 @@ class Config:
             repo
         ]}
 
+        self.documents = {name: {} for name in self.configs}
+        self.seen = {name: set() for name in self.configs}
+        self.expected = {name: None for name in self.configs}
+        self.replayed = asyncio.Event()
+        self.restored = False
+        self.synced = asyncio.Event()
+        self.pending_save = None
+        self.batch = {}
+        self.pending_flush = None
+
     async def init(self):
+        self.restore()
+
         await self.connection.connect()
+        await self.count_tables()
         unpack = itemgetter("config", "old_val", "new_val")
 
         async def update(x):
             cfg, old, new = unpack(x)
+            key = (new if new is not None else old)[self.configs[cfg].key]
 
-            try:
-                if new is None:
-                    self.latest_config[cfg].delete(old)
-                else:
-                    self.latest_config[cfg].set(new)
-            except:
-                logger.exception(f"Unhandled error while updating config {cfg}.")
-            else:
-                logger.info(f"Updated config {cfg} with {x}")
+            if self.seen is not None and new is not None:
+                self.seen[cfg].add(key)
+                self.check_replayed()
+
+            logger.debug(f"Received config change {x}")
+            self.enqueue(cfg, key, old, new)
 
-        return await subscribe(
+        subscription = await subscribe(
             from_iterable(self.configs.values())
                 | Operators.flat_map(self.config_observable),
             AsyncAnonymousObserver(update))
 
+        asyncio.ensure_future(self.reconcile())
+        return subscription
+
+    def enqueue(self, cfg, key, old, new):
+        """Coalesce a change into the pending batch, keeping the first old and the latest new value."""
+        first = self.batch.get((cfg, key))
+        if first is not None:
+            old = first[0]
+
+        self.batch[cfg, key] = (old, new)
+
+        if self.pending_flush is None:
+            self.pending_flush = asyncio.get_event_loop().call_later(self.batch_window, self.flush)
+
+    def flush(self):
+        """Apply the pending batch in one go.
+
+        Nothing yields to the event loop while the batch is applied, so
+        tasks never observe a partially applied batch.
+        """
+        batch, self.batch = self.batch, {}
+        self.pending_flush = None
+
+        applied = 0
+        for (cfg, _), (old, new) in batch.items():
+            if old is None and new is None:
+                continue
+
+            applied += self.apply(cfg, old, new)
+
+        logger.info(f"Applied {applied} of {len(batch)} config change(s).")
+
+    def apply(self, cfg, old, new):
+        key = self.configs[cfg].key
+
+        try:
+            if new is None:
+                self.latest_config[cfg].delete(old)
+            else:
+                self.latest_config[cfg].set(new)
+        except:
+            logger.exception(f"Unhandled error while updating config {cfg}.")
+            return False
+
+        if new is None:
+            self.documents[cfg].pop(old[key], None)
+        else:
+            self.documents[cfg][new[key]] = new
+
+        self.schedule_save()
+        return True
+
+    def restore(self):
+        if self.snapshot_path is None:
+            return
+
+        try:
+            tables = snapshot.load(self.snapshot_path)
+        except Exception:
+            logger.exception(f"Could not read config snapshot {self.snapshot_path}, waiting for the database.")
+            return
+
+        if tables is None:
+            return
+
+        for cfg, documents in tables.items():
+            if cfg in self.configs:
+                for document in documents:
+                    self.apply(cfg, None, document)
+
+        self.restored = True
+        logger.info(f"Restored config snapshot {self.snapshot_path}, reconciling with the database.")
+
+    async def count_tables(self):
+        """Count every table, so that the end of its initial replay can be recognised."""
+        db = self.connection.db()
+
+        for name in self.configs:
+            try:
+                self.expected[name] = await self.connection.run(db.table(name).count())
+            except Exception:
+                logger.exception(f"Could not count table {name}, waiting up to {self.sync_timeout}s for its replay.")
+
+        self.check_replayed()
+
+    def replay_complete(self, cfg):
+        return self.expected[cfg] is not None and len(self.seen[cfg]) >= self.expected[cfg]
+
+    def check_replayed(self):
+        if all(self.replay_complete(cfg) for cfg in self.configs):
+            self.replayed.set()
+
+    async def reconcile(self):
+        """Mark the config synced once the initial replay of every table has arrived.
+
+        Documents restored from the snapshot that a complete replay did not
+        contain were deleted while the worker was down and are removed.
+        Tables whose replay is still incomplete after CONFIG_SYNC_TIMEOUT are
+        left as they are.
+        """
+        try:
+            await asyncio.wait_for(self.replayed.wait(), self.sync_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Initial config replay incomplete after {self.sync_timeout}s, continuing.")
+
+        if self.pending_flush is not None:
+            self.pending_flush.cancel()
+            self.flush()
+
+        for cfg, seen in self.seen.items():
+            if not self.replay_complete(cfg):
+                continue
+
+            for key in set(self.documents[cfg]) - seen:
+                logger.info(f"Removing {cfg} {key} which is no longer in the database.")
+                self.apply(cfg, self.documents[cfg][key], None)
+
+        self.synced.set()
+        self.seen = None
+        self.schedule_save()
+        logger.info("Config synced with the database.")
+
+    def schedule_save(self):
+        if self.snapshot_path is None or not self.synced.is_set() or self.pending_save is not None:
+            return
+
+        self.pending_save = asyncio.ensure_future(self.save())
+
+    async def save(self):
+        await asyncio.sleep(self.snapshot_interval)
+        self.pending_save = None
+
+        tables = {cfg: list(documents.values()) for cfg, documents in self.documents.items()}
+
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, snapshot.save, self.snapshot_path, tables)
+        except Exception:
+            logger.exception(f"Could not write config snapshot {self.snapshot_path}.")
+
     async def config_observable(self, cfg):
         return self.connection.start_with_and_changes(self.connection.db().table(cfg.name))\
             | Operators.map(lambda elem: {**elem, "config": cfg.name})\
 
+    async def teardown(self):
+        await asyncio.gather(*(cfg.teardown() for cfg in self.latest_config.values()))
+
     def environments(self) -> environment.Environments:
         return self.latest_config[environment.name]
 
@@ -68,6 +230,9 @@ class Config:
     def repos(self) -> repo.Repos:
         return self.latest_config[repo.name]
 
+    def routes(self) -> routing.RoutingTable:
+        return self.routing
+
 
 class keydefaultdict(defaultdict):
     def __missing__(self, key):
@@ -8,4 +8,7 @@ class ConfigABC(metaclass=ABCMeta):
 
     @abstractmethod
     def delete(self, old):
-        pass
\ No newline at end of file
+        pass
+
+    async def teardown(self):
+        pass
@@ -1,27 +1,151 @@
+import os
 import re
-import kube
-import base64
-import docker
-import os.path
+import json
+import time
+import asyncio
 import functools
-import posixpath as ppath
+import importlib
+import contextlib
 
+from concurrent.futures import ThreadPoolExecutor
 from logzero import logger
-from kubernetes import APISAServer
 from abc import ABCMeta, abstractmethod
 
 from configuration.abc import ConfigABC
+from configuration.singleflight import SingleFlight
+import configuration.sharding as sharding
+from metrics import timed, environment_reachable
 
 class Environments(ConfigABC):
-    def __init__(self):
+    """Environment configs, with clients built only for the environments this worker owns.
+
+    Tasks for an environment owned by another worker share one borrowed
+    client, which neither probes nor tracks the inventory. It is closed
+    once it has been unused for BORROW_IDLE_TIMEOUT seconds: until then its
+    connections, login cache and in-flight pulls are reused, at the cost
+    of holding a client for an environment this worker does not own.
+    """
+    def __init__(self, routes, shard=sharding.shard):
         super().__init__()
         self.environments = {}
+        self.documents = {}
+        self.borrowed = {}
+        self.expiries = {}
+        self.borrow_idle = float(os.environ.get('BORROW_IDLE_TIMEOUT', 60))
+        self.routes = routes
+        self.shard = shard
+        self.shard.listeners.append(self.rebalance)
 
     def set(self, environment):
-        self.environments[environment['name']] = convert(environment["name"], environment)
+        name = environment['name']
+        self.documents[name] = environment
+        self.routes.set_environment(name, re.compile(environment['tag-match']) if 'tag-match' in environment else None)
+
+        borrowed = self.borrowed.get(name)
+        if borrowed is not None:
+            if self.owns(name) or borrowed.connection != connection_key(environment):
+                self.give_back(name)
+            else:
+                borrowed.configure(environment)
+
+        if self.owns(name):
+            self.build(environment)
+        else:
+            self.release(name)
+
+    def build(self, environment):
+        old = self.environments.get(environment['name'])
+
+        if old is not None and old.connection == connection_key(environment):
+            logger.debug(f"Environment {old.name} connection unchanged, keeping its client.")
+            old.configure(environment)
+            return old
+
+        env = self.environments[environment['name']] = convert(environment["name"], environment)
+        env.start_probing()
+
+        if old is not None:
+            asyncio.ensure_future(old.close())
+
+        return env
+
+    def release(self, name):
+        old = self.environments.pop(name, None)
+
+        if old is not None:
+            asyncio.ensure_future(old.close())
 
     def delete(self, environment):
-        self.environments.pop(environment['name'], None)
+        self.documents.pop(environment['name'], None)
+        self.routes.delete_environment(environment['name'])
+        self.release(environment['name'])
+        self.give_back(environment['name'])
+
+    def owns(self, name):
+        return self.shard.owns(name)
+
+    def rebalance(self):
+        for name, environment in self.documents.items():
+            if not self.owns(name):
+                self.release(name)
+                continue
+
+            self.give_back(name)
+            if name not in self.environments:
+                try:
+                    self.build(environment)
+                except Exception:
+                    logger.exception(f"Could not connect to environment {name} after rebalancing.")
+
+        logger.info(f"Owning {len(self.environments)} of {len(self.documents)} environment(s).")
+
+    async def teardown(self):
+        self.shard.listeners.remove(self.rebalance)
+        for expiry in self.expiries.values():
+            expiry.cancel()
+
+        environments, self.environments = self.environments, {}
+        borrowed, self.borrowed, self.expiries = self.borrowed, {}, {}
+        await asyncio.gather(*(env.close() for env in [*environments.values(), *borrowed.values()]))
+
+    @contextlib.contextmanager
+    def use(self, name):
+        """The client of an environment, marked in use for the duration of an operation."""
+        env = self.environments.get(name) or self.borrow(name)
+
+        try:
+            with env.in_use():
+                yield env
+        finally:
+            if self.borrowed.get(name) is env and not env.active:
+                self.expiries[name] = asyncio.get_event_loop().call_later(self.borrow_idle, self.give_back, name)
+
+    def borrow(self, name):
+        expiry = self.expiries.pop(name, None)
+        if expiry is not None:
+            expiry.cancel()
+
+        env = self.borrowed.get(name)
+        if env is None:
+            logger.info(f"Environment {name} is not connected on this worker, borrowing a client.")
+            env = self.borrowed[name] = convert(name, self.documents[name])
+            env.transient = True
+
+        return env
+
+    def give_back(self, name):
+        """Close the borrowed client of an environment, once the operations using it are done."""
+        expiry = self.expiries.pop(name, None)
+        if expiry is not None:
+            expiry.cancel()
+
+        env = self.borrowed.pop(name, None)
+        if env is not None:
+            logger.debug(f"Closing borrowed client of environment {name}.")
+            asyncio.ensure_future(env.close())
+
+    def __contains__(self, item):
+        return item in self.environments
 
     def __getitem__(self, item):
         return self.environments[item]
@@ -31,9 +155,15 @@ class Environments(ConfigABC):
 
 
 name = 'environments'
+key = 'name'
 init = Environments
 
 
+def connection_key(environment):
+    """The options that require a new client when they change."""
+    return json.dumps({key: environment.get(key) for key in ('mode', 'tls', 'parameters')}, sort_keys=True)
+
+
 def convert(name, environment):
     assert 'mode' in environment, f"Environment {name} missing required option 'mode'."
 
@@ -42,136 +172,205 @@ def convert(name, environment):
 
     params = environment.get('parameters', {})
 
-    convert_fn = modes[mode]
+    convert_fn = backend(mode)
     return convert_fn(name, environment, **params)
 
 
-def convert_tls(name, environment, **params):
-    url = environment['tls']['url']
+modes = {
+    'tls': ('configuration.swarm', 'convert_tls'),
+    'from_env': ('configuration.swarm', 'convert_env'),
+    'k8s_serviceaccount': ('configuration.k8s', 'convert_sa')
+}
 
-    cert = environment['tls']['cert']
-    key = environment['tls']['key']
-    ca = environment['tls']['ca']
 
-    for file in [cert, key, ca]:
-        assert os.path.isfile(file), f"File {os.path.abspath(file)} does not exist!"
+@functools.lru_cache()
+def backend(mode):
+    """The convert function of a mode, importing its backend on first use."""
+    module, fn = modes[mode]
+    return getattr(importlib.import_module(module), fn)
 
-    tls_config = docker.tls.TLSConfig(
-        client_cert=(cert, key),
-        ca_cert=ca,
-        verify=True
-    )
 
-    client = docker.DockerClient(base_url=url, tls=tls_config, **params)
-    return DockerSwarm(name, environment, client)
+class Environment(metaclass=ABCMeta):
+    def __init__(self, name, environment):
+        self.name = name
+        self.connection = connection_key(environment)
+        self.executor = None
+        self.logins = SingleFlight()
+        self.inventory = {}
+        self.inventory_synced = False
+        self.inventory_task = None
+        self.reachable = None
+        self.latency = None
+        self.probe_task = None
+        self.transient = False
+        self.active = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.configure(environment)
+
+    def configure(self, environment):
+        """Apply the options that do not affect the client connection."""
+        self.sign = bool(environment.get('sign', False))
+        concurrency = int(environment.get('concurrency', 4))
+        assert concurrency > 0, f"Environment {self.name} concurrency must be positive."
 
+        if self.executor is None or concurrency != self.concurrency:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
 
-def convert_env(name, environment, **params):
-    return DockerSwarm(name, environment, docker.from_env(**params))
+            self.concurrency = concurrency
+            self.executor = ThreadPoolExecutor(max_workers=concurrency)
 
+        self.logins.ttl = float(environment.get('login-cache-ttl', 300))
+        self.rollout_timeout = float(environment.get('rollout-timeout', 0))
+        self.inventory_resync = float(environment.get('inventory-resync', 300))
+        self.probe_interval = float(environment.get('probe-interval', 30))
+        self.probe_timeout = float(environment.get('probe-timeout', 5))
 
-def convert_sa(name, environment, **params):
-    url = environment['tls']['url']
+    def prefetch(self, image):
+        """Start fetching an image ahead of its update, if the environment supports it."""
+        pass
 
-    ca = environment['tls']['ca']
-    with open(environment['tls']['token']) as f:
-        token = f.read()
+    def track_inventory(self):
+        """Start keeping the service inventory of this environment current."""
+        if self.inventory_task is None and not self.transient:
+            self.inventory_task = asyncio.ensure_future(self.maintain_inventory())
 
-    jwt = base64.b64decode(token).decode()
+    def stop_inventory(self):
+        if self.inventory_task is not None:
+            self.inventory_task.cancel()
+            self.inventory_task = None
 
-    proxy = APISAServer(url, token=jwt, cafile=ca)
-    cluster = kube.Cluster(url=url, proxy=proxy)
-    return K8sCluster(name, environment, cluster)
+        self.inventory = {}
+        self.inventory_synced = False
 
+    @abstractmethod
+    async def maintain_inventory(self):
+        pass
 
-modes = {
-    'tls': convert_tls,
-    'from_env': convert_env,
-    'k8s_serviceaccount': convert_sa
-}
+    def start_probing(self):
+        """Warm the connection now and keep it alive with a probe every 'probe-interval' seconds."""
+        if self.probe_task is None:
+            self.probe_task = asyncio.ensure_future(self.keep_alive())
 
+    def stop_probing(self):
+        if self.probe_task is not None:
+            self.probe_task.cancel()
+            self.probe_task = None
 
-class Environment(metaclass=ABCMeta):
-    def __init__(self, name, environment):
-        self.name = name
-        self.sign = bool(environment.get('sign', False))
-        self.has_tag_match = 'tag-match' in environment
+        try:
+            environment_reachable.remove(self.name)
+        except KeyError:
+            pass
+
+    async def keep_alive(self):
+        await self.probe('warm_up', self.warm_up)
+
+        while self.probe_interval > 0:
+            await asyncio.sleep(self.probe_interval)
+            await self.probe('probe', self.ping)
+
+    async def probe(self, phase, check):
+        start = time.monotonic()
+
+        try:
+            with timed(phase, self.name):
+                await asyncio.wait_for(check(), self.probe_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.reachable is not False:
+                logger.warning(f'Environment {self.name} is unreachable: {e!r}')
+
+            self.reachable = False
+        else:
+            if self.reachable is False:
+                logger.info(f'Environment {self.name} is reachable again.')
+
+            self.reachable = True
+
+        self.latency = time.monotonic() - start
+        environment_reachable.labels(self.name).set(int(self.reachable))
+
+    async def warm_up(self):
+        """Establish the client's connection ahead of the first task."""
+        await self.ping()
+
+    async def wait_for_rollout(self, rollout, poll=None):
+        """Wait up to 'rollout-timeout' seconds for a rollout future to complete.
+
+        `poll` is called every few seconds as a safety net for missed events.
+        """
+        start = time.monotonic()
+        deadline = start + self.rollout_timeout
+
+        with timed('rollout', self.name) as timer:
+            while not rollout.done() and time.monotonic() < deadline:
+                await asyncio.wait([rollout], timeout=min(5.0, max(0.0, deadline - time.monotonic())))
+
+                if not rollout.done() and poll is not None:
+                    outcome = await poll()
+                    if outcome is not None and not rollout.done():
+                        rollout.set_result(outcome)
 
-        if self.has_tag_match:
-            self.tag_match = re.compile(environment['tag-match'])
+            if rollout.done():
+                outcome = rollout.result()
+            else:
+                rollout.cancel()
+                outcome = 'timeout'
 
-    def should_push(self, tag):
-        if not self.has_tag_match:
-            return False
+            timer.outcome = outcome
 
-        return self.tag_match.fullmatch(tag)
+        return {"rollout": outcome, "rollout_seconds": round(time.monotonic() - start, 3)}
+
+    @contextlib.contextmanager
+    def in_use(self):
+        """Count an operation on this environment, so that closing it waits for the operation to finish."""
+        self.active += 1
+        self.idle.clear()
+
+        try:
+            yield self
+        finally:
+            self.active -= 1
+            if not self.active:
+                self.idle.set()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking client call on this environment's own thread pool."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def close(self):
+        """Wait for operations in use and calls already handed to the pool, then release the client.
+
+        An environment replaced by a config change or released to another
+        worker may still be serving a deploy that looked it up earlier.
+        """
+        self.stop_inventory()
+        self.stop_probing()
+
+        if self.active:
+            logger.debug(f'Environment {self.name} closing after {self.active} operation(s) in use.')
+            await self.idle.wait()
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.executor.shutdown)
 
     @abstractmethod
-    def login(self, *args, **kwargs):
+    async def login(self, *args, **kwargs):
         pass
 
     @abstractmethod
-    def services(self):
+    async def services(self):
         pass
 
     @abstractmethod
-    def update(self, svc_name, image):
+    async def ping(self):
+        """Whether the environment's API answers."""
         pass
 
+    @abstractmethod
+    async def update(self, svc_name, image):
+        pass
 
-class DockerSwarm(Environment):
-    def __init__(self, name, environment, client):
-        super().__init__(name, environment)
-        self.client = client
-
-    def login(self, *args, **kwargs):
-        self.client.login(*args, **kwargs)
-
-    def services(self):
-        return (service.name for service in self.client.services.list())
-
-    def update(self, svc_name, image):
-        try:
-            repo, tag = image.split(':')
-        except ValueError:
-            repo = image
-            tag = "latest"
-
-        pull = self.client.images.pull(repo, tag=tag)
-        logger.debug(f'Image pulled: {pull.id}')
-
-        svc = self.client.services.get(svc_name)
-        svc.update_preserve(image=pull.id)
-
-
-class K8sCluster(Environment):
-    def __init__(self, name, environment, cluster):
-        super().__init__(name, environment)
-        self.cluster = cluster
-        self.namespace = environment.get('namespace', 'default')
-        self.deployments = kube.DeploymentView(cluster, namespace=self.namespace)
-
-    def login(self, *args, **kwargs):
-        logger.debug(f'Attempting to login to kubernetes environment, image update may fail.')
-
-    def services(self):
-        for deployment in self.deployments:
-            yield deployment.meta.name
-
-    def update(self, svc_name, image):
-        deployment = self.deployments.fetch(svc_name)
-        
-        self.cluster.proxy.patch(deployment.meta.link, patch={
-            "spec": {
-                "template": {
-                    "spec": {
-                        "containers": [
-                            {
-                                "image": image,
-                                "name": svc_name
-                            }
-                        ]
-                    }
-                }
-            }
-        })
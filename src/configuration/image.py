@@ -0,0 +1,47 @@
+from collections import namedtuple
+from functools import lru_cache
+
+
+class ImageRef(namedtuple('ImageRef', ['registry', 'user', 'repo', 'tag', 'digest'])):
+    """A parsed image reference. Registry, user and digest may be None; so may tag when pinned by digest."""
+    __slots__ = ()
+
+    @property
+    def repository(self):
+        """The image name without its registry, e.g. user/repo."""
+        return self.repo if self.user is None else f'{self.user}/{self.repo}'
+
+    @property
+    def name(self):
+        """The full image name without tag or digest, e.g. registry:5000/user/repo."""
+        return self.repository if self.registry is None else f'{self.registry}/{self.repository}'
+
+    @property
+    def version(self):
+        """What to pull: the digest if the reference has one, else the tag."""
+        return self.digest or self.tag
+
+    def __str__(self):
+        image = self.name
+        if self.tag is not None:
+            image += f':{self.tag}'
+        if self.digest is not None:
+            image += f'@{self.digest}'
+
+        return image
+
+
+@lru_cache(maxsize=4096)
+def parse(image):
+    """Parse an image reference such as registry:5000/user/repo:tag@sha256:..., defaulting the tag to latest."""
+    rest, _, digest = image.partition('@')
+    parts = rest.split('/')
+
+    registry = None
+    if len(parts) > 1 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+        registry = parts.pop(0)
+
+    repo, _, tag = parts[-1].partition(':')
+    user = '/'.join(parts[:-1]) or None
+
+    return ImageRef(registry, user, repo, tag or (None if digest else 'latest'), digest or None)
@@ -0,0 +1,106 @@
+import time
+
+from collections import namedtuple
+from logzero import logger
+from docker import auth
+from docker.utils.json_stream import json_stream
+
+from metrics import pull_bytes, pull_layers, pulls_in_progress
+
+
+layer_states = ('Pulling fs layer', 'Waiting', 'Downloading', 'Verifying Checksum', 'Download complete',
+                'Extracting', 'Pull complete', 'Already exists')
+
+
+class PullError(Exception):
+    pass
+
+
+class Pulled(namedtuple('Pulled', ['reference', 'id', 'digests'])):
+    """A pulled image: the reference to deploy, its image id and its repo digests."""
+
+
+def open_pull(client, ref):
+    """Start a pull like APIClient.pull(stream=True), but return the response so that it can be closed."""
+    api = client.api
+    registry, _ = auth.resolve_repository_name(ref.name)
+
+    headers = {}
+    header = auth.get_config_header(api, registry)
+    if header:
+        headers['X-Registry-Auth'] = header
+
+    response = api._post(api._url('/images/create'), params={'fromImage': ref.name, 'tag': ref.version},
+                         headers=headers, stream=True, timeout=None)
+    api._raise_for_status(response)
+    return response
+
+
+def stream_pull(client, environment, ref, stop=None, report_interval=10.0):
+    """Pull an image while consuming the daemon's progress stream one event at a time.
+
+    Memory stays constant in the size of the stream; only the latest
+    progress of every layer is kept. Fails on the first error event, and
+    abandons the pull once the `stop` event is set.
+    """
+    image = str(ref)
+    layers = {}
+    states = {}
+    digest = None
+    started = last_report = time.monotonic()
+
+    with pulls_in_progress.labels(environment).track_inprogress():
+        response = open_pull(client, ref)
+        try:
+            for event in json_stream(client.api._stream_helper(response)):
+                if stop is not None and stop.is_set():
+                    raise PullError(f'Pull of {image} in environment {environment} cancelled')
+
+                if 'error' in event:
+                    raise PullError(f'Pulling {image} in environment {environment} failed: {event["error"]}')
+
+                status = event.get('status', '')
+                if status.startswith('Digest: '):
+                    digest = status[len('Digest: '):]
+
+                layer = event.get('id')
+                progress = event.get('progressDetail') or {}
+
+                if layer and status in layer_states and states.get(layer) != status:
+                    logger.debug(f'Pulling {image} in environment {environment}: layer {layer} '
+                                 f'{states.get(layer, "new")} -> {status}')
+                    states[layer] = status
+
+                    if status in ('Pull complete', 'Already exists'):
+                        pull_layers.labels(environment, 'pulled' if status == 'Pull complete' else 'existing').inc()
+
+                if layer and status == 'Downloading' and 'current' in progress:
+                    previous = layers.get(layer, (0, 0))[0]
+                    layers[layer] = (progress['current'], progress.get('total', 0))
+                    pull_bytes.labels(environment).inc(max(0, progress['current'] - previous))
+                elif layer and status in ('Download complete', 'Already exists', 'Pull complete'):
+                    current, total = layers.get(layer, (0, 0))
+                    layers[layer] = (max(current, total), total)
+
+                now = time.monotonic()
+                if now - last_report >= report_interval:
+                    last_report = now
+                    current = sum(c for c, _ in layers.values())
+                    total = sum(t for _, t in layers.values())
+                    done = sum(1 for state in states.values() if state in ('Pull complete', 'Already exists'))
+                    logger.info(f'Pulling {image} in environment {environment}: {current}/{total} bytes, '
+                                f'{done}/{len(states)} layers complete after {now - started:.0f}s')
+        finally:
+            response.close()
+
+    logger.debug(f'Image pulled: {image} ({digest}) in {time.monotonic() - started:.1f}s')
+
+    if ref.digest is not None:
+        return Pulled(image, None, [f'{ref.name}@{ref.digest}'])
+
+    if digest is not None:
+        return Pulled(f'{image}@{digest}', None, [f'{ref.name}@{digest}'])
+
+    # Images the daemon already had may not report a digest; fall back to inspecting it.
+    pulled = client.images.get(image)
+    return Pulled(pulled.id, pulled.id, pulled.attrs.get('RepoDigests', []))
@@ -1,29 +1,59 @@
 from collections import defaultdict
+import os.path
 import json
 import re
 
 from configuration.abc import ConfigABC
+from configuration.singleflight import SingleFlight
+from metrics import timed
+
+credential_files = SingleFlight(ttl=300)
+
 
 class Repo:
     defaults = {
         "login": None,
-        "glob": "(.*)/(.*):(.*)"
+        "glob": None
     }
 
     def __init__(self, repo):
         repo = {**Repo.defaults, **repo}
 
         self.login_file = repo['login']
-        self.glob = re.compile(repo['glob'])
+        self.glob = re.compile(repo['glob']) if repo['glob'] is not None else None
+
+    def translate(self, ref):
+        """The image name and tag to route a reference by, or None if it does not match the repo's glob."""
+        if self.glob is None:
+            return ref.name, ref.tag or ''
+
+        match = self.glob.fullmatch(str(ref))
+        if not match:
+            return None
+
+        return f"{match.group(1)}/{match.group(2)}", match.group(3)
 
     def require_login(self):
         return self.login_file is not None
 
-    def login_to(self, client):
+    def credentials(self):
         with open(self.login_file) as file:
-            credentials = json.load(file)
-            client.login(
-                username=credentials['username'], password=credentials['password'])
+            return json.load(file)
+
+    async def login_to(self, environment):
+        """Log in to the registry, reusing a recent login by the same environment.
+
+        Credential files are re-read and logins redone when the file changes.
+        """
+        mtime = await environment.run(os.path.getmtime, self.login_file)
+        credentials = await credential_files.do(
+            (self.login_file, mtime), environment.run, self.credentials)
+
+        registry = credentials.get('registry')
+        with timed('login', environment.name):
+            await environment.logins.do(
+                (registry, self.login_file, mtime), environment.login,
+                username=credentials['username'], password=credentials['password'], registry=registry)
 
 
 class Repos(ConfigABC):
@@ -48,17 +78,19 @@ class Repos(ConfigABC):
     def delete(self, user):
         self.repos.pop(user['user'], None)
 
-    def repo(self, image):
-        image = image.split("/")
-
-        if len(image) == 2:
-            user, repo = image
-            repo = repo.split(":")[0]
+    def repo(self, ref):
+        users = self.repos.get(ref.user) if ref.registry is None \
+            else self.repos.get(f"{ref.registry}/{ref.user}") or self.repos.get(ref.user)
 
-            return self.repos[user][repo]
-        else:
+        if not users:
             return Repos.default_repo
 
+        return users[ref.repo]
+
 
 name = "repos"
-init = Repos
+key = "user"
+
+
+def init(routes):
+    return Repos()
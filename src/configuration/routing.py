@@ -0,0 +1,70 @@
+from collections import defaultdict, namedtuple
+
+
+class Target(namedtuple('Target', ['environment', 'service', 'matcher'])):
+    def accepts(self, tag):
+        if self.matcher is None:
+            return False
+
+        return self.matcher.fullmatch(tag)
+
+
+class RoutingTable:
+    """Inverted index from image name (user/repo) to its deployment targets.
+
+    Kept current in place by Services and Environments as changefeed events
+    arrive, so routing a pushed image is a single dict lookup.
+    """
+    def __init__(self):
+        self.images = {}
+        self.matchers = {}
+        self.targets = defaultdict(dict)
+        self.by_environment = defaultdict(set)
+
+    def set_service(self, svc_name, service):
+        self.delete_service(svc_name)
+        self.images[svc_name] = service.image
+
+        entry = self.targets[service.image]
+        for env_name in service.environments:
+            entry[env_name, svc_name] = Target(env_name, svc_name, self.matchers.get(env_name))
+            self.by_environment[env_name].add(svc_name)
+
+    def delete_service(self, svc_name):
+        image = self.images.pop(svc_name, None)
+        if image is None:
+            return
+
+        entry = self.targets[image]
+        for env_name, name in list(entry):
+            if name == svc_name:
+                del entry[env_name, name]
+                self.by_environment[env_name].discard(svc_name)
+
+        if not entry:
+            del self.targets[image]
+
+    def set_environment(self, env_name, matcher):
+        self.matchers[env_name] = matcher
+        self.rematch(env_name)
+
+    def delete_environment(self, env_name):
+        self.matchers.pop(env_name, None)
+        self.rematch(env_name)
+
+    def rematch(self, env_name):
+        matcher = self.matchers.get(env_name)
+
+        for svc_name in self.by_environment[env_name]:
+            entry = self.targets[self.images[svc_name]]
+            entry[env_name, svc_name] = Target(env_name, svc_name, matcher)
+
+    def route(self, image):
+        entry = self.targets.get(image)
+        if entry is None:
+            return []
+
+        return list(entry.values())
+
+    def __repr__(self):
+        return repr({image: list(entry) for image, entry in self.targets.items()})
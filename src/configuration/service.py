@@ -3,18 +3,18 @@ from functools import lru_cache
 from configuration.abc import ConfigABC
 
 class Services(ConfigABC):
-    def __init__(self):
+    def __init__(self, routes):
         super().__init__()
         self.services = {}
+        self.routes = routes
 
     def set(self, service):
-        self.services[service["name"]] = Service(service)
+        svc = self.services[service["name"]] = Service(service)
+        self.routes.set_service(service["name"], svc)
 
     def delete(self, service):
         self.services.pop(service['name'], None)
-
-    def using_image(self, image):
-        return {name: service for name, service in self.services.items() if service.image == image}
+        self.routes.delete_service(service['name'])
 
     def __getitem__(self, item):
         return self.services[item]
@@ -24,6 +24,7 @@ class Services(ConfigABC):
 
 
 name = 'services'
+key = 'name'
 init = Services
 
 class Service:
@@ -0,0 +1,95 @@
+import os
+import socket
+import asyncio
+import hashlib
+
+from bisect import bisect
+from logzero import logger
+
+
+def point(value):
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+class Ring:
+    """Consistent hash ring with virtual nodes per member."""
+    def __init__(self, members, replicas=64):
+        self.members = tuple(sorted(members))
+        self.points = sorted((point(f"{member}#{i}"), member) for member in self.members for i in range(replicas))
+        self.keys = [p for p, _ in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+
+        return self.points[bisect(self.keys, point(key)) % len(self.points)][1]
+
+
+class Shard:
+    """Which environments this worker owns, agreed on through consistent hashing over the live workers.
+
+    The live workers are the addresses the DNS name in SHARD_PEERS resolves
+    to, such as 'tasks.<service>' in a swarm. Without SHARD_PEERS every
+    worker owns every environment.
+    """
+    def __init__(self, peers=None, interval=10.0):
+        self.peers = peers
+        self.interval = interval
+        self.me = None
+        self.ring = Ring([])
+        self.listeners = []
+        self.task = None
+
+    @staticmethod
+    def from_env():
+        return Shard(os.environ.get('SHARD_PEERS'), float(os.environ.get('SHARD_INTERVAL', 10)))
+
+    @property
+    def enabled(self):
+        return self.peers is not None
+
+    def owns(self, key):
+        if not self.enabled:
+            return True
+
+        return self.me is not None and self.ring.owner(key) == self.me
+
+    def start(self, me):
+        if not self.enabled:
+            return
+
+        self.me = me
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                members = await self.resolve()
+            except Exception as e:
+                logger.warning(f"Could not resolve workers through {self.peers}: {e!r}")
+            else:
+                if members != self.ring.members:
+                    logger.info(f"Worker set changed to {list(members)}, rebalancing environments.")
+                    self.ring = Ring(members)
+                    self.rebalance()
+
+            await asyncio.sleep(self.interval)
+
+    async def resolve(self):
+        infos = await asyncio.get_event_loop().getaddrinfo(self.peers, None, proto=socket.IPPROTO_TCP)
+        return tuple(sorted({info[4][0] for info in infos} | {self.me}))
+
+    def rebalance(self):
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception:
+                logger.exception("Unhandled error while rebalancing.")
+
+
+shard = Shard.from_env()
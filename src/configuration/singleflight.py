@@ -0,0 +1,75 @@
+import asyncio
+import functools
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into one in-flight call.
+
+    Successful results are remembered for `ttl` seconds so that repeat calls
+    shortly after completion are answered without running the call again.
+    """
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self.flights = {}
+        self.waiters = {}
+        self.results = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+
+        cached = self.results.get(key)
+        if cached is not None:
+            expires, result = cached
+            if expires > loop.time():
+                return result
+
+            del self.results[key]
+
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            flight.add_done_callback(functools.partial(self.landed, key))
+
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(flight)
+        finally:
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
+
+    def in_flight(self, key):
+        return key in self.flights
+
+    def landed(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+        if self.ttl <= 0 or flight.cancelled() or flight.exception() is not None:
+            return
+
+        now = asyncio.get_event_loop().time()
+        for stale in [k for k, (expires, _) in self.results.items() if expires <= now]:
+            del self.results[stale]
+
+        self.results[key] = (now + self.ttl, flight.result())
+
+    def remember(self, key, result):
+        """Cache a result obtained elsewhere as if a call for the key had just landed."""
+        if self.ttl > 0:
+            self.results[key] = (asyncio.get_event_loop().time() + self.ttl, result)
+
+    def cancel(self, key):
+        """Cancel a flight that has at most one waiter; shared flights keep running."""
+        flight = self.flights.get(key)
+        if flight is None or self.waiters.get(key, 0) > 1:
+            return False
+
+        flight.cancel()
+        return True
+
+    def forget(self, key):
+        self.results.pop(key, None)
+
+    def clear(self):
+        self.results.clear()
@@ -0,0 +1,32 @@
+import os
+import json
+import time
+
+version = 1
+
+
+def load(path):
+    """Read the documents of every table from a snapshot, or None if there is no usable snapshot."""
+    try:
+        with open(path) as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return None
+
+    if snapshot.get('version') != version:
+        return None
+
+    return snapshot['tables']
+
+
+def save(path, tables):
+    """Atomically replace the snapshot with the given documents of every table.
+
+    RethinkDB changefeeds cannot be resumed, so no feed position is stored;
+    the snapshot is always reconciled against a fresh feed instead.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as file:
+        json.dump({"version": version, "saved": time.time(), "tables": tables}, file, default=str)
+
+    os.replace(tmp, path)
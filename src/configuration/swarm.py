@@ -0,0 +1,264 @@
+import asyncio
+import docker
+import os.path
+import functools
+import threading
+
+from logzero import logger
+
+import monkey_patch
+from configuration.environment import Environment
+from configuration.image import parse
+from configuration.singleflight import SingleFlight
+from configuration.pull import stream_pull
+from configuration.watch import Waiters, SwarmEvents, swarm_rollout
+from metrics import timed
+
+monkey_patch.setup()
+
+
+def convert_tls(name, environment, **params):
+    url = environment['tls']['url']
+
+    cert = environment['tls']['cert']
+    key = environment['tls']['key']
+    ca = environment['tls']['ca']
+
+    for file in [cert, key, ca]:
+        assert os.path.isfile(file), f"File {os.path.abspath(file)} does not exist!"
+
+    tls_config = docker.tls.TLSConfig(
+        client_cert=(cert, key),
+        ca_cert=ca,
+        verify=True
+    )
+
+    client = docker.DockerClient(base_url=url, tls=tls_config, **params)
+    return DockerSwarm(name, environment, client)
+
+
+def convert_env(name, environment, **params):
+    return DockerSwarm(name, environment, docker.from_env(**params))
+
+
+class DockerSwarm(Environment):
+    def __init__(self, name, environment, client):
+        self.client = client
+        self.pulls = SingleFlight()
+        self.pinned = SingleFlight()
+        self.prefetches = {}
+        self.rollouts = Waiters()
+        self.refreshes = SingleFlight()
+        self.events = SwarmEvents(client, name)
+        self.events.listeners.append(self.service_event)
+        super().__init__(name, environment)
+
+    def configure(self, environment):
+        super().configure(environment)
+        self.pinned.ttl = float(environment.get('pull-cache-ttl', 30))
+        self.prefetch_budget = int(environment.get('prefetch', 0))
+
+    async def close(self):
+        # Nobody is waiting on an unclaimed prefetch; updates that joined one keep it alive.
+        for ref in list(self.prefetches.values()):
+            self.flights(ref).cancel(ref)
+
+        await super().close()
+        self.events.stop()
+        self.client.api.close()
+
+    def service_event(self, event):
+        actor = event.get('Actor', {})
+        attributes = actor.get('Attributes', {})
+
+        if 'updatestate.new' in attributes:
+            self.rollouts.notify(actor['ID'], attributes['updatestate.new'])
+
+        if not self.inventory_synced:
+            return
+
+        if event.get('Action') == 'remove':
+            self.inventory.pop(attributes.get('name'), None)
+        elif event.get('Action') in ('create', 'update'):
+            asyncio.ensure_future(self.refreshes.do(actor['ID'], self.refresh_service, actor['ID']))
+
+    async def refresh_service(self, service_id):
+        try:
+            svc = await self.run(self.client.services.get, service_id)
+        except docker.errors.NotFound:
+            return
+        except Exception as e:
+            logger.warning(f'Could not refresh service {service_id} in environment {self.name}: {e!r}')
+            return
+
+        self.inventory[svc.name] = svc
+
+    async def maintain_inventory(self):
+        """List all services once, follow service events, and list again every 'inventory-resync' seconds."""
+        self.events.start()
+
+        while True:
+            try:
+                services = await self.run(self.client.services.list)
+            except Exception as e:
+                logger.warning(f'Could not list services in environment {self.name}: {e!r}')
+                await asyncio.sleep(5)
+                continue
+
+            self.inventory = {svc.name: svc for svc in services}
+            self.inventory_synced = True
+            await asyncio.sleep(self.inventory_resync)
+
+    async def login(self, *args, **kwargs):
+        await self.run(self.client.login, *args, **kwargs)
+
+    async def ping(self):
+        # Not queued behind pulls and updates on the environment's own pool.
+        return await asyncio.get_event_loop().run_in_executor(None, self.client.ping)
+
+    async def warm_up(self):
+        await asyncio.get_event_loop().run_in_executor(None, self.client.version)
+
+    async def services(self):
+        if self.inventory_synced:
+            return list(self.inventory)
+
+        return [service.name for service in await self.run(self.client.services.list)]
+
+    def prefetch(self, image):
+        """Pull an image in the background so that its update can attach to the pull.
+
+        At most 'prefetch' pulls run ahead per environment; an unclaimed
+        prefetch of an older tag of the same repository is cancelled unless
+        another caller has joined its pull.
+        """
+        if not self.prefetch_budget:
+            return
+
+        ref = parse(image)
+        previous = self.prefetches.pop(ref.name, None)
+
+        if previous is not None and previous != ref:
+            if self.flights(previous).cancel(previous):
+                logger.debug(f'Prefetch of {previous} in environment {self.name} superseded by {ref}')
+
+        if len(self.prefetches) >= self.prefetch_budget:
+            logger.debug(f'Prefetch budget of environment {self.name} exhausted, not prefetching {image}')
+            return
+
+        self.prefetches[ref.name] = ref
+        prefetch = asyncio.ensure_future(self.pull(ref))
+        prefetch.add_done_callback(functools.partial(self.prefetched, ref))
+
+    def prefetched(self, ref, prefetch):
+        if self.prefetches.get(ref.name) == ref:
+            del self.prefetches[ref.name]
+
+        if not prefetch.cancelled() and prefetch.exception() is not None:
+            logger.warning(f'Prefetch of {ref} in environment {self.name} failed: {prefetch.exception()!r}')
+
+    def flights(self, ref):
+        # A tag can be re-pushed at any time, so only pulls by digest are remembered once they land.
+        return self.pulls if ref.digest is None else self.pinned
+
+    async def pull(self, ref):
+        """Pull an image, sharing one in-flight pull per reference.
+
+        Pulls by digest, including the digests tag pulls resolved to, are
+        also remembered for 'pull-cache-ttl' seconds.
+        """
+        flights = self.flights(ref)
+        if flights.in_flight(ref):
+            logger.debug(f'Joining in-flight pull of {ref} in environment {self.name}')
+
+        return await flights.do(ref, self._pull, ref)
+
+    async def _pull(self, ref):
+        stop = threading.Event()
+
+        try:
+            with timed('pull', self.name):
+                pulled = await self.run(stream_pull, self.client, self.name, ref, stop)
+        except asyncio.CancelledError:
+            # Otherwise the pull would keep downloading on the pool after its flight is cancelled.
+            stop.set()
+            raise
+
+        if ref.digest is None:
+            for digest in pulled.digests:
+                self.pinned.remember(parse(digest), pulled)
+
+        return pulled
+
+    async def update(self, svc_name, image):
+        ref = parse(image)
+
+        if self.prefetches.get(ref.name) == ref:
+            # Claimed by an update, so a newer tag must no longer cancel it.
+            del self.prefetches[ref.name]
+
+        pull = await self.pull(ref)
+
+        self.track_inventory()
+
+        with timed('update', self.name) as timer:
+            for attempt in range(2):
+                svc = self.inventory.get(svc_name) if not attempt else None
+                if svc is None:
+                    svc = await self.run(self.client.services.get, svc_name)
+
+                current = svc.attrs['Spec']['TaskTemplate']['ContainerSpec']['Image']
+
+                if same_image(current, pull):
+                    logger.info(f'Service {svc_name} in environment {self.name} already runs {image}, skipping.')
+                    timer.outcome = 'skipped'
+                    return {"status": "skipped", "current": current}
+
+                if self.rollout_timeout:
+                    self.events.start()
+                    rollout = self.rollouts.wait(svc.id, swarm_rollout)
+
+                try:
+                    await self.run(svc.update_preserve, image=pull.reference)
+                except docker.errors.APIError as e:
+                    if self.rollout_timeout:
+                        rollout.cancel()
+
+                    if attempt or 'out of sequence' not in str(e):
+                        raise
+
+                    logger.debug(f'Inventory entry of service {svc_name} in environment {self.name} was stale, retrying.')
+                else:
+                    break
+                finally:
+                    # Its version is now outdated; the update event refreshes it.
+                    self.inventory.pop(svc_name, None)
+
+        result = {"status": "updated", "previous": current}
+        if self.rollout_timeout:
+            started = svc.attrs.get('UpdateStatus', {}).get('StartedAt')
+            result.update(await self.wait_for_rollout(rollout, functools.partial(self.poll_rollout, svc, started)))
+
+        return result
+
+    async def poll_rollout(self, svc, started):
+        await self.run(svc.reload)
+        status = svc.attrs.get('UpdateStatus', {})
+
+        # An update status that started before our update belongs to a previous rollout.
+        if status.get('StartedAt') == started:
+            return None
+
+        return swarm_rollout(status.get('State'))
+
+
+def same_image(current, pulled):
+    """Whether a service image reference resolves to the pulled image."""
+    if current in (pulled.reference, pulled.id):
+        return True
+
+    _, _, digest = current.partition('@')
+    if not digest:
+        return False
+
+    return any(ref.partition('@')[2] == digest for ref in pulled.digests)
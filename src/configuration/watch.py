@@ -0,0 +1,119 @@
+import time
+import asyncio
+import threading
+
+from collections import defaultdict
+from logzero import logger
+
+
+class Waiters:
+    """Futures waiting for an object, keyed by name or id, to reach a state.
+
+    Each waiter has a check that maps the latest object to an outcome, or to
+    None while it should keep waiting.
+    """
+    def __init__(self):
+        self.waiters = defaultdict(list)
+
+    def wait(self, key, check):
+        future = asyncio.get_event_loop().create_future()
+        self.waiters[key].append((check, future))
+        return future
+
+    def notify(self, key, obj):
+        waiters = self.waiters.get(key)
+        if not waiters:
+            return
+
+        for check, future in list(waiters):
+            if not future.done():
+                outcome = check(obj)
+                if outcome is None:
+                    continue
+
+                future.set_result(outcome)
+
+            waiters.remove((check, future))
+
+        if not waiters:
+            del self.waiters[key]
+
+
+class SwarmEvents:
+    """Follows the service events of one Docker daemon on a dedicated thread.
+
+    Events are handed to every listener on the event loop. The stream is
+    reopened after errors until the watch is stopped.
+    """
+    def __init__(self, client, environment, backoff=5.0):
+        self.client = client
+        self.environment = environment
+        self.backoff = backoff
+        self.listeners = []
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.loop = asyncio.get_event_loop()
+        self.thread = threading.Thread(
+            target=self.consume, name=f'events-{self.environment}', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def consume(self):
+        while not self.stopped:
+            try:
+                for event in self.client.events(filters={'type': 'service'}, decode=True):
+                    if self.stopped:
+                        return
+
+                    self.loop.call_soon_threadsafe(self.dispatch, event)
+            except Exception as e:
+                if self.stopped:
+                    return
+
+                logger.warning(f'Event stream of environment {self.environment} failed: {e!r}, reconnecting.')
+
+            time.sleep(self.backoff)
+
+    def dispatch(self, event):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception(f'Unhandled error in event listener of environment {self.environment}.')
+
+
+def swarm_rollout(state):
+    """Outcome of a swarm service update state, or None while it is in progress."""
+    if state == 'completed':
+        return 'completed'
+
+    if state in ('paused', 'rollback_started', 'rollback_paused', 'rollback_completed'):
+        return 'failed'
+
+    return None
+
+
+def deployment_rollout(deployment, generation):
+    """Outcome of a deployment rollout to the given generation, or None while it is in progress."""
+    status = deployment.get('status', {})
+
+    for condition in status.get('conditions', []):
+        if condition.get('type') == 'Progressing' and condition.get('reason') == 'ProgressDeadlineExceeded':
+            return 'failed'
+
+    if status.get('observedGeneration', 0) < generation:
+        return None
+
+    replicas = deployment['spec'].get('replicas', 1)
+    if status.get('updatedReplicas', 0) == replicas and status.get('replicas', 0) == replicas \
+            and status.get('availableReplicas', 0) == replicas:
+        return 'completed'
+
+    return None
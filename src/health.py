@@ -0,0 +1,88 @@
+import time
+import asyncio
+
+from aiohttp import web
+from logzero import logger
+
+
+class Health:
+    """Orchestrator reachability refreshed in the background, and the environments' own probe results.
+
+    Probes answer from this state, so their cost does not depend on how
+    often they are made.
+    """
+    def __init__(self, worker, cfg, interval=10.0, timeout=5.0):
+        self.worker = worker
+        self.cfg = cfg
+        self.interval = interval
+        self.timeout = timeout
+        self.orchestrator = False
+        self.checked = None
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Unhandled error while refreshing health.")
+
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self):
+        self.orchestrator = await self.check(self.worker.ping())
+        self.checked = time.time()
+
+    async def check(self, probe):
+        try:
+            return bool(await asyncio.wait_for(probe, self.timeout))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return False
+
+    def environments(self):
+        return {name: {"reachable": env.reachable, "latency": env.latency}
+                for name, env in self.cfg.environments().items()}
+
+    def ready(self, environments):
+        return self.cfg.synced.is_set() and self.orchestrator \
+            and all(env["reachable"] for env in environments.values())
+
+    async def status(self, request):
+        return web.json_response({
+            "orchestrator_ping": self.orchestrator,
+            "config_synced": self.cfg.synced.is_set(),
+            "checked": self.checked,
+            "status": 0 if self.orchestrator else 1
+        }, status=200 if self.orchestrator else 503)
+
+    async def live(self, request):
+        return web.json_response({"status": 0})
+
+    async def readiness(self, request):
+        environments = self.environments()
+        ready = self.ready(environments)
+        return web.json_response({
+            "ready": ready,
+            "config_synced": self.cfg.synced.is_set(),
+            "orchestrator": self.orchestrator,
+            "environments": environments,
+            "checked": self.checked
+        }, status=200 if ready else 503)
+
+    def setup_routes(self, app):
+        app.router.add_get("/", self.status)
+        app.router.add_get("/live", self.live)
+        app.router.add_get("/ready", self.readiness)
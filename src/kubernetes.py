@@ -1,8 +1,115 @@
-import kube
+import ssl
+import json
+import asyncio
+import aiohttp
 
+from urllib.parse import urljoin
 
-class APISAServer(kube.APIServerProxy):
+api_paths = {
+    'deployments': ['apis/apps/v1', 'apis/apps/v1beta2', 'apis/apps/v1beta1', 'apis/extensions/v1beta1']
+}
+
+
+class KubeError(Exception):
+    pass
+
+
+class Cluster:
+    """Minimal asynchronous Kubernetes API client authenticated with a service account token.
+
+    Keeps one pooled aiohttp session per cluster and discovers the API path
+    of every resource kind once.
+    """
     def __init__(self, url, token=None, cafile=None):
-        super().__init__(url)
-        self._session.verify = cafile
-        self._session.headers.update({"Authorization": f"Bearer {token}"})
\ No newline at end of file
+        if not url.endswith('/'):
+            url += '/'
+
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.ssl_context = ssl.create_default_context(cafile=cafile) if cafile else None
+        self.api_paths = {}
+        self._session = None
+        self.closed = False
+
+    @property
+    def session(self):
+        if self.closed:
+            raise KubeError(f"Client for {self.url} is closed")
+
+        if self._session is None:
+            connector = aiohttp.TCPConnector(ssl_context=self.ssl_context)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+
+        return self._session
+
+    async def request(self, method, path, **kwargs):
+        async with self.session.request(method, urljoin(self.url, path), **kwargs) as response:
+            if response.status >= 300:
+                raise KubeError(f"{method} {path} failed with status {response.status}: {await response.text()}")
+
+            return await response.json()
+
+    async def api_path(self, resource):
+        path = self.api_paths.get(resource)
+        if path is None:
+            path = self.api_paths[resource] = asyncio.ensure_future(self.find_api_path(resource))
+
+        try:
+            return await asyncio.shield(path)
+        except Exception:
+            if self.api_paths.get(resource) is path:
+                del self.api_paths[resource]
+            raise
+
+    async def find_api_path(self, resource):
+        """Find the most recent API version base path serving a resource kind."""
+        for option in api_paths[resource]:
+            try:
+                resources = await self.request('GET', option)
+            except KubeError:
+                continue
+
+            if any(r['name'] == resource for r in resources.get('resources', [])):
+                return option
+
+        raise KubeError(
+            f'Failed to reach API for base path {self.url} and API version base path options list {api_paths[resource]}')
+
+    async def link(self, resource, namespace, name=None):
+        path = f"{await self.api_path(resource)}/namespaces/{namespace}/{resource}"
+        return path if name is None else f"{path}/{name}"
+
+    async def list(self, resource, namespace):
+        return await self.request('GET', await self.link(resource, namespace))
+
+    async def get(self, resource, namespace, name):
+        return await self.request('GET', await self.link(resource, namespace, name))
+
+    async def patch(self, resource, namespace, name, patch):
+        return await self.request(
+            'PATCH', await self.link(resource, namespace, name),
+            data=json.dumps(patch),
+            headers={"Content-Type": "application/strategic-merge-patch+json"})
+
+    async def watch(self, resource, namespace, resource_version=None, timeout=None):
+        """Yield watch events of every object of a kind in a namespace until the server ends the watch."""
+        params = {"watch": "true"}
+        if resource_version is not None:
+            params["resourceVersion"] = resource_version
+        if timeout is not None:
+            params["timeoutSeconds"] = str(int(timeout))
+
+        url = urljoin(self.url, await self.link(resource, namespace))
+        async with self.session.get(url, params=params, timeout=None) as response:
+            if response.status >= 300:
+                raise KubeError(f"Watch of {resource} failed with status {response.status}: {await response.text()}")
+
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def close(self):
+        self.closed = True
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
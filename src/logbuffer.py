@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+from collections import deque
+from prometheus_client import Counter
+
+records_dropped = Counter('cion_worker_log_records_dropped_total', 'Log records dropped because the log buffer was full.')
+records_unshipped = Counter('cion_worker_log_records_unshipped_total', 'Log records lost because their insert failed.')
+
+
+class BufferedHandler(logging.Handler):
+    """Queues log records in memory and inserts them into the database in batches.
+
+    Logging never waits on the database. When the buffer is full the oldest
+    records are dropped and counted. Every `interval` seconds the buffer is
+    written with one multi-document insert per `chunk` records.
+    """
+    def __init__(self, insert, origin, capacity=10000, interval=1.0, chunk=200):
+        super().__init__()
+        self.insert = insert
+        self.origin = origin
+        self.interval = interval
+        self.chunk = chunk
+        self.records = deque(maxlen=capacity)
+        self.dropped = 0
+        self.task = None
+
+    def emit(self, record):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+            records_dropped.inc()
+
+        self.records.append(record)
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.ship()
+
+    async def ship(self):
+        while self.records:
+            batch = []
+            while self.records and len(batch) < self.chunk:
+                batch.append(self.records.popleft())
+
+            try:
+                await self.insert([self.document(record) for record in batch])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                records_unshipped.inc(len(batch))
+                self.handleError(batch[0])
+
+    def document(self, record):
+        return {
+            "origin": self.origin,
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": self.format(record),
+        }
+
+    async def drain(self):
+        """Stop the background task and ship everything still buffered."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        await self.ship()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        super().close()
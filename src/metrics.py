@@ -0,0 +1,40 @@
+import time
+
+from aiohttp import web
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+
+phase_seconds = Histogram(
+    'cion_worker_phase_seconds', 'Duration of worker phases; the _count series count them by outcome.',
+    ['phase', 'environment', 'outcome'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf')))
+
+tasks_in_flight = Gauge('cion_worker_tasks_in_flight', 'Tasks currently executing.', ['task'])
+queued_updates = Gauge('cion_worker_queued_updates', 'Updates waiting behind an in-flight update of the same service.')
+
+pulls_in_progress = Gauge('cion_worker_pulls_in_progress', 'Image pulls currently streaming.', ['environment'])
+pull_bytes = Counter('cion_worker_pull_bytes_total', 'Image layer bytes downloaded by pulls.', ['environment'])
+pull_layers = Counter(
+    'cion_worker_pull_layers_total', 'Image layers completed by pulls, pulled or already present.', ['environment', 'state'])
+
+environment_reachable = Gauge(
+    'cion_worker_environment_reachable', 'Whether the last probe of an environment succeeded.', ['environment'])
+
+
+class timed:
+    """Observe the duration of a phase, labelled 'ok' or 'error' unless the outcome is set explicitly."""
+    def __init__(self, phase, environment=''):
+        self.phase = phase
+        self.environment = environment
+        self.outcome = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = self.outcome or ('ok' if exc_type is None else 'error')
+        phase_seconds.labels(self.phase, self.environment, outcome).observe(time.monotonic() - self.start)
+
+
+async def endpoint(request):
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
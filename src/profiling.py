@@ -0,0 +1,156 @@
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+from collections import Counter
+from aiohttp import web
+from logzero import logger
+from prometheus_client import Counter as MetricCounter, Histogram
+
+loop_lag = Histogram(
+    'cion_worker_loop_lag_seconds', 'How late the event loop ran a scheduled heartbeat.',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, float('inf')))
+loop_stalls = MetricCounter('cion_worker_loop_stalls_total', 'Times the event loop was blocked past the stall threshold.')
+
+
+def current_task(loop):
+    get = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+    try:
+        return get(loop=loop)
+    except RuntimeError:
+        return None
+
+
+def collapse(frame):
+    """A stack in the collapsed 'outer;...;inner' format flame graph tools read."""
+    return ';'.join(f'{f.f_code.co_name} ({f.f_code.co_filename}:{f.f_code.co_firstlineno})'
+                    for f, _ in reversed(list(traceback.walk_stack(frame))))
+
+
+class StallDetector:
+    """Measures event loop lag and reports the task and stack of whatever blocks the loop.
+
+    A heartbeat on the loop records how late it runs; a watchdog thread
+    samples the loop thread's stack once a heartbeat is overdue.
+    """
+    def __init__(self, threshold=0.5, interval=0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.beat = time.monotonic()
+        self.task = None
+        self.stopped = False
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        self.loop_thread = threading.get_ident()
+        self.loop.slow_callback_duration = self.threshold
+        self.task = asyncio.ensure_future(self.heartbeat())
+        threading.Thread(target=self.watch, name='stall-detector', daemon=True).start()
+
+    def stop(self):
+        self.stopped = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.beat = now = time.monotonic()
+            loop_lag.observe(max(0.0, now - expected))
+
+    def watch(self):
+        reported = None
+        while not self.stopped:
+            time.sleep(self.interval)
+
+            beat = self.beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold or reported == beat:
+                continue
+
+            reported = beat
+            loop_stalls.inc()
+
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else '  <unavailable>\n'
+            logger.warning(f'Event loop blocked for {blocked:.2f}s in {current_task(self.loop)!r}:\n{stack}')
+
+
+class Sampler:
+    """Sampling profiler of the event loop thread, collecting collapsed stacks."""
+    def __init__(self):
+        self.samples = Counter()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.started = None
+        self.duration = 0.0
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, interval=0.005):
+        if self.running:
+            return
+
+        self.samples.clear()
+        self.stopped = threading.Event()
+        self.target = threading.get_ident()
+        self.interval = interval
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.sample, name='sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stopped.set()
+            thread.join()
+            self.duration = time.monotonic() - self.started
+
+    def sample(self):
+        stopped = self.stopped
+        while not stopped.is_set():
+            frame = sys._current_frames().get(self.target)
+            if frame is not None:
+                self.samples[collapse(frame)] += 1
+            del frame
+
+            stopped.wait(self.interval)
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+sampler = Sampler()
+
+
+async def start_profile(request):
+    try:
+        interval = float(request.query.get('interval', 0.005))
+    except ValueError:
+        interval = 0
+
+    if not 0 < interval <= 1:
+        return web.json_response({"error": "interval must be between 0 and 1 second"}, status=400)
+
+    sampler.start(interval)
+    return web.json_response({"running": True, "interval": sampler.interval})
+
+
+async def stop_profile(request):
+    sampler.stop()
+    return web.json_response({"running": False, "seconds": sampler.duration, "samples": sum(sampler.samples.values())})
+
+
+async def profile(request):
+    return web.Response(text=sampler.collapsed())
+
+
+def setup_routes(app):
+    app.router.add_post('/profile/start', start_profile)
+    app.router.add_post('/profile/stop', stop_profile)
+    app.router.add_get('/profile', profile)
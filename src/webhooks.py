@@ -0,0 +1,114 @@
+import re
+import json
+import random
+import functools
+import asyncio
+import aiohttp
+
+from logzero import logger
+from metrics import timed
+
+
+def should_send(on, data):
+    return compile_filter(json.dumps(on, sort_keys=True))(data)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_filter(on):
+    """Compile a hook's 'on' tree, keyed by its canonical JSON, into a predicate."""
+    return Filter(json.loads(on))
+
+
+class Filter:
+    def __init__(self, on):
+        self.rules = [(key, Filter(value) if isinstance(value, dict) else leaf(value))
+                      for key, value in on.items()]
+
+    def __call__(self, data):
+        try:
+            return all(rule(data[key]) for key, rule in self.rules)
+        except (KeyError, TypeError):
+            return False
+
+
+def leaf(value):
+    try:
+        e = re.compile(value)
+    except (TypeError, re.error):
+        return lambda actual: value == actual
+    else:
+        return lambda actual: isinstance(actual, str) and e.match(actual) is not None
+
+
+class Dispatcher:
+    """Delivers webhooks over a long-lived pooled session.
+
+    Concurrency is capped globally and per host by the connection pool, and
+    failed deliveries are retried with exponential backoff and full jitter.
+    """
+    def __init__(self, limit=100, limit_per_host=8, retries=3, backoff=0.5, max_backoff=30.0, timeout=10.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+        return self._session
+
+    async def dispatch(self, hooks, data):
+        return await asyncio.gather(*(self.deliver(hook, data) for hook in hooks if should_send(hook['on'], data)))
+
+    async def deliver(self, hook, data):
+        with timed('webhook') as timer:
+            result = await self.send(hook, data)
+            timer.outcome = 'ok' if result['ok'] else 'failed'
+            return result
+
+    async def send(self, hook, data):
+        result = {"url": hook['url'], "ok": False, "status": None, "attempts": 0}
+
+        try:
+            body = hook['body'].format(**data).encode()
+        except (KeyError, IndexError, ValueError) as e:
+            logger.warning(f"Webhook {hook['url']} body could not be formatted: {e!r}")
+            return {**result, "error": f"Body could not be formatted: {e!r}"}
+
+        expected = hook.get('expected-status', 200)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+            result["attempts"] = attempt + 1
+
+            try:
+                async with self.session.post(hook['url'], data=body, headers=hook['headers'],
+                                             timeout=self.timeout) as response:
+                    result["status"] = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result["error"] = repr(e)
+                continue
+
+            if response.status == expected:
+                result.pop("error", None)
+                return {**result, "ok": True}
+
+            result["error"] = f"Webhook responded with unexpected status {response.status}"
+            if response.status < 500 and response.status != 429:
+                break
+
+        logger.warning(f"Webhook {hook['url']} failed after {result['attempts']} attempt(s): {result['error']}")
+        return result
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,50 +1,94 @@
 import asyncio
 import logging
 import socket
-import re
 import os
 
 from async_rethink import connection
-from async_rethink.reactive import parallel
 from cion_interface.service import service
 
 from logzero import logger, loglevel
 from aiohttp import web
-import aiohttp
 
 from configuration import config, Config
+from configuration.sharding import shard
+from configuration.image import parse
+from coalesce import CoalescingQueue, Superseded
+from webhooks import Dispatcher
+from logbuffer import BufferedHandler
+from metrics import timed, tasks_in_flight, queued_updates
+from metrics import endpoint as metrics_endpoint
+import profiling
+from health import Health
 
 loglevel(int(os.environ.get("LOGLEVEL", 10)))
 
 cfg: Config = None
+updates = CoalescingQueue()
+queued_updates.set_function(lambda: len(updates))
+webhooks = Dispatcher(
+    limit=int(os.environ.get("WEBHOOK_CONCURRENCY", 100)),
+    limit_per_host=int(os.environ.get("WEBHOOK_HOST_CONCURRENCY", 8)),
+    retries=int(os.environ.get("WEBHOOK_RETRIES", 3)),
+    timeout=float(os.environ.get("WEBHOOK_TIMEOUT", 10)))
 
 
 @service.distribute_to.implement
 async def distribute_to(image):
-    re = cfg.repos().repo(image).glob
-    match = re.fullmatch(image)
+    with tasks_in_flight.labels('distribute_to').track_inprogress(), timed('distribute_to') as timer:
+        targets = route(image)
 
-    if not match:
-        logger.info(f"New image '{image}' did not match pattern {re}.")
+        if not targets:
+            timer.outcome = 'no_targets'
+
+        environments = cfg.environments()
+        for env_name, target_image in {(env_name, target_image) for env_name, _, target_image in targets}:
+            if env_name in environments:
+                prefetch(environments[env_name], target_image)
+
+        return targets
+
+
+def prefetch(environment, image):
+    repo_cfg = cfg.repos().repo(parse(image))
+
+    if not repo_cfg.require_login():
+        environment.prefetch(image)
+        return
+
+    # Without the registry login the pull would fail, and so would any update joining it.
+    async def login_and_prefetch():
+        try:
+            await repo_cfg.login_to(environment)
+        except Exception as e:
+            logger.warning(f"Login for prefetch of {image} in environment {environment.name} failed: {e!r}")
+            return
+
+        environment.prefetch(image)
+
+    asyncio.ensure_future(login_and_prefetch())
+
+
+def route(image):
+    ref = parse(image)
+    repo_cfg = cfg.repos().repo(ref)
+    translated = repo_cfg.translate(ref)
+
+    if translated is None:
+        logger.info(f"New image '{image}' did not match pattern {repo_cfg.glob}.")
         return []
 
-    user, repo, tag = match.group(1), match.group(2), match.group(3)
-    translated_img = f"{user}/{repo}"
+    translated_img, tag = translated
     logger.debug(f"Image: {image} -> {translated_img}")
 
-    logger.debug(f"Services: {cfg.services().services}")
-    services = cfg.services().using_image(f"{user}/{repo}")
-    logger.debug(f"Services using image {translated_img}: {services}")
+    targets = cfg.routes().route(translated_img)
+    logger.debug(f"Targets for image {translated_img}: {targets}")
 
     ret = []
 
-    for svc_name, service in services.items():
-        for env_name in service.environments:
-            environment = cfg.environments()[env_name]
-
-            if environment.should_push(tag):
-                logger.debug(f"Environment {env_name} accepted image {image} with tag {tag}")
-                ret.append((env_name, svc_name, image))
+    for target in targets:
+        if target.accepts(tag):
+            logger.debug(f"Environment {target.environment} accepted image {image} with tag {tag}")
+            ret.append((target.environment, target.service, image))
 
     if not len(ret):
         logger.warn(f"No targets found for image {image}")
@@ -56,56 +100,46 @@ async def distribute_to(image):
 
 @service.update.implement
 async def update(env, svc_name, image: str):
-    repo_cfg = cfg.repos().repo(image)
-    environment = cfg.environments()[env]
+    try:
+        with tasks_in_flight.labels('update').track_inprogress():
+            result = await updates.submit((env, svc_name), deploy, env, svc_name, image)
+    except Superseded:
+        logger.info(
+            f"Update of service {svc_name} in environment {env} to {image} superseded by a newer image.")
+        result = {"status": "superseded"}
 
-    if repo_cfg.require_login():
-        repo_cfg.login_to(environment)
-    
-    logger.info(
-        f"Updating image {image} for service {svc_name} in environment {env}.")
+    return {**result, "image": image}
 
-    environment.update(svc_name, image)
-
-@service.webhook.implement
-async def webhook(hooks, data):
-    async with aiohttp.ClientSession() as session:
-        await parallel(handle_webhook(session, hook, data) for hook in hooks if should_send(hook['on'], data))
 
+async def deploy(env, svc_name, image):
+    repo_cfg = cfg.repos().repo(parse(image))
 
-def should_send(on, data):
-    for key, value in on.items():
-        if isinstance(value, dict):
-            if not should_send(value, data[key]):
-                return False
-        else:
-            try:
-                e = re.compile(value)
-            except:
-                if value != data[key]:
-                    return False
-            else:
-                if not e.match(data[key]):
-                    return False
+    with cfg.environments().use(env) as environment:
+        if repo_cfg.require_login():
+            await repo_cfg.login_to(environment)
 
-    return True
+        logger.info(
+            f"Updating image {image} for service {svc_name} in environment {env}.")
 
+        return await environment.update(svc_name, image)
 
-async def handle_webhook(session, hook, data):
-    params = {
-        "data": hook['body'].format(**data).encode(),
-        "headers": hook['headers']
-    }
 
-    async with session.post(hook['url'], **params) as response:
-        assert response.status == hook.get('expected-status', 200),\
-            f"Webhook responded with unexpected status {response.status}"
+@service.webhook.implement
+async def webhook(hooks, data):
+    with tasks_in_flight.labels('webhook').track_inprogress():
+        return await webhooks.dispatch(hooks, data)
 
 
 async def main(loop):
     from workq.worker import Orchestrator
-    from monkey_patch import setup
-    setup()
+
+    stalls = None
+    if "LOOP_STALL_THRESHOLD" in os.environ:
+        stalls = profiling.StallDetector(threshold=float(os.environ["LOOP_STALL_THRESHOLD"]))
+        stalls.start()
+
+        # Debug mode additionally logs every callback slower than the threshold, at some overhead.
+        loop.set_debug(os.environ.get("LOOP_DEBUG") == "1")
 
     address = os.environ['ORCHESTRATOR_ADDRESS']
 
@@ -119,9 +153,19 @@ async def main(loop):
     global cfg
     cfg = await config()
 
+    if not cfg.restored:
+        await cfg.synced.wait()
+
     worker = await orchestrator.join(service)
+    shard.start(worker.own_ip())
 
-    hc = setup_healthcheck(worker)
+    health = Health(
+        worker, cfg,
+        interval=float(os.environ.get("HEALTH_INTERVAL", 10)),
+        timeout=float(os.environ.get("HEALTH_TIMEOUT", 5)))
+    health.start()
+
+    hc = setup_healthcheck(health)
     handler = hc.make_handler()
 
     srv = await loop.create_server(handler, '0.0.0.0', 5000)
@@ -130,9 +174,22 @@ async def main(loop):
     logger.debug(f'Healthcheck endpoint started on http://{addr}:{port}')
 
     db = await connection(db_host, db_port)
-    log_handler = db.get_log_handler(f"worker-{worker.own_ip()}")
+    log_table = db.db().table(os.environ.get("LOG_TABLE", "logs"))
+    origin = f"worker-{worker.own_ip()}"
+
+    async def insert_logs(documents):
+        await db.run(log_table.insert(documents))
+
+    log_handler = BufferedHandler(
+        insert_logs, origin,
+        capacity=int(os.environ.get("LOG_BUFFER_SIZE", 10000)),
+        interval=float(os.environ.get("LOG_FLUSH_INTERVAL", 1)),
+        chunk=int(os.environ.get("LOG_SHIP_CHUNK", 200)))
     log_handler.setLevel(logging.INFO)
+    # Messages are formatted the way the database log handler would format them.
+    log_handler.setFormatter(db.get_log_handler(origin).formatter)
     logger.addHandler(log_handler)
+    log_handler.start()
 
     try:
         await worker.run_until_complete()
@@ -140,23 +197,27 @@ async def main(loop):
         pass
     finally:
         srv.close()
+        health.stop()
         await hc.shutdown()
         await handler.shutdown(60.0)
         await handler.finish_connections(1.0)
         await hc.cleanup()
-        cfg.teardown()
-
-
-def setup_healthcheck(worker):
-    async def endpoint(request):
-        ping = await worker.ping()
-        return web.json_response({
-            "orchestrator_ping": ping,
-            "status": 0 if ping else 1
-        }, status=200)
-
+        await webhooks.close()
+        shard.stop()
+        profiling.sampler.stop()
+        if stalls is not None:
+            stalls.stop()
+        await cfg.teardown()
+        logger.removeHandler(log_handler)
+        await log_handler.drain()
+        log_handler.close()
+
+
+def setup_healthcheck(health):
     app = web.Application()
-    app.router.add_get("/", endpoint)
+    health.setup_routes(app)
+    app.router.add_get("/metrics", metrics_endpoint)
+    profiling.setup_routes(app)
     return app
 
 